@@ -3,95 +3,220 @@ Utility script to inspect MTGA SQLite database files (.mtga) and summarize their
 """
 import argparse
 import json
+import os
 import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+
+MAX_WORKERS = 32
+
+
+def open_readonly(db_path: Path) -> sqlite3.Connection:
+    # SQLite releases the GIL while it works, so each worker thread gets its own read-only connection.
+    uri = db_path.resolve().as_uri() + "?mode=ro&immutable=1"
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
 
 
 def quote_identifier(name: str) -> str:
     return '"' + name.replace('"', '""') + '"'
 
 
-def fetch_table_columns(connection: sqlite3.Connection, table: str) -> List[Dict[str, object]]:
-    cursor = connection.execute(f"PRAGMA table_info({quote_identifier(table)})")
-    columns = []
+def fetch_table_columns(connection: sqlite3.Connection) -> Dict[str, List[Dict[str, object]]]:
+    cursor = connection.execute(
+        """
+        SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+        FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+        WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+        """
+    )
+    columns: Dict[str, List[Dict[str, object]]] = {}
     for row in cursor.fetchall():
-        columns.append(
+        columns.setdefault(row[0], []).append(
             {
-                "cid": row[0],
-                "name": row[1],
-                "type": row[2],
-                "not_null": bool(row[3]),
-                "default_value": row[4],
-                "primary_key_position": row[5],
+                "cid": row[1],
+                "name": row[2],
+                "type": row[3],
+                "not_null": bool(row[4]),
+                "default_value": row[5],
+                "primary_key_position": row[6],
             }
         )
     return columns
 
 
-def fetch_indexes(connection: sqlite3.Connection, table: str) -> List[Dict[str, object]]:
-    indexes = []
-    cursor = connection.execute(f"PRAGMA index_list({quote_identifier(table)})")
-    for index_row in cursor.fetchall():
-        index_name = index_row[1]
-        index_info = connection.execute(f"PRAGMA index_info({quote_identifier(index_name)})").fetchall()
-        indexes.append(
+def fetch_indexes(connection: sqlite3.Connection) -> Dict[str, List[Dict[str, object]]]:
+    # The LEFT JOIN keeps indexes without index_info rows; seqno is NULL for those.
+    cursor = connection.execute(
+        """
+        SELECT m.name, il.name, il."unique", il.origin, il.partial, ii.seqno, ii.name
+        FROM sqlite_master AS m
+        JOIN pragma_index_list(m.name) AS il
+        LEFT JOIN pragma_index_info(il.name) AS ii
+        WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+        """
+    )
+    indexes: Dict[str, List[Dict[str, object]]] = {}
+    by_name: Dict[Tuple[str, str], Dict[str, object]] = {}
+    for row in cursor.fetchall():
+        index = by_name.get((row[0], row[1]))
+        if index is None:
+            index = by_name[(row[0], row[1])] = {
+                "name": row[1],
+                "unique": bool(row[2]),
+                "origin": row[3],
+                "partial": bool(row[4]),
+                "columns": [],
+            }
+            indexes.setdefault(row[0], []).append(index)
+        if row[5] is not None:
+            index["columns"].append(row[6])
+    return indexes
+
+
+def fetch_foreign_keys(connection: sqlite3.Connection) -> Dict[str, List[Dict[str, object]]]:
+    cursor = connection.execute(
+        """
+        SELECT m.name, fk.id, fk.seq, fk."table", fk."from", fk."to", fk.on_update, fk.on_delete, fk."match"
+        FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS fk
+        WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+        """
+    )
+    foreign_keys: Dict[str, List[Dict[str, object]]] = {}
+    for row in cursor.fetchall():
+        foreign_keys.setdefault(row[0], []).append(
             {
-                "name": index_name,
-                "unique": bool(index_row[2]),
-                "origin": index_row[3],
-                "partial": bool(index_row[4]),
-                "columns": [info[2] for info in index_info],
+                "id": row[1],
+                "seq": row[2],
+                "table": row[3],
+                "from_column": row[4],
+                "to_column": row[5],
+                "on_update": row[6],
+                "on_delete": row[7],
+                "match": row[8],
             }
         )
-    return indexes
+    return foreign_keys
 
 
-def fetch_foreign_keys(connection: sqlite3.Connection, table: str) -> List[Dict[str, object]]:
-    cursor = connection.execute(f"PRAGMA foreign_key_list({quote_identifier(table)})")
-    return [
-        {
-            "id": row[0],
-            "seq": row[1],
-            "table": row[2],
-            "from_column": row[3],
-            "to_column": row[4],
-            "on_update": row[5],
-            "on_delete": row[6],
-            "match": row[7],
+def fetch_table_details(connection: sqlite3.Connection) -> Dict[str, Dict[str, list]]:
+    """Collect columns, indexes and foreign keys for every table in three queries."""
+    columns = fetch_table_columns(connection)
+    indexes = fetch_indexes(connection)
+    foreign_keys = fetch_foreign_keys(connection)
+    return {
+        table: {
+            "columns": table_columns,
+            "indexes": indexes.get(table, []),
+            "foreign_keys": foreign_keys.get(table, []),
         }
-        for row in cursor.fetchall()
-    ]
+        for table, table_columns in columns.items()
+    }
 
 
-def fetch_row_count(connection: sqlite3.Connection, table: str) -> Optional[int]:
-    try:
-        cursor = connection.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}")
-        return cursor.fetchone()[0]
-    except sqlite3.DatabaseError:
-        return None
+def fetch_row_count(connection: sqlite3.Connection, table: str, exact: bool) -> Tuple[Optional[int], Optional[str]]:
+    """Return a row count and the method used to obtain it.
+
+    COUNT(*) scans the whole table, so unless an exact count is requested the count comes from
+    sqlite_stat1 (when ANALYZE has been run) or from max(rowid), an upper bound read off the B-tree.
+    """
+    if exact:
+        try:
+            cursor = connection.execute(f"SELECT COUNT(*) FROM {quote_identifier(table)}")
+            return cursor.fetchone()[0], "count"
+        except sqlite3.DatabaseError:
+            return None, None
 
+    try:
+        # Partial index stats only count the indexed subset of rows, so they are skipped.
+        row = connection.execute(
+            """
+            SELECT s.stat FROM sqlite_stat1 AS s
+            WHERE s.tbl = ?
+              AND (s.idx IS NULL OR s.idx IN (SELECT name FROM pragma_index_list(?) WHERE partial = 0))
+            ORDER BY s.idx IS NOT NULL
+            LIMIT 1
+            """,
+            (table, table),
+        ).fetchone()
+        if row and row[0]:
+            return int(row[0].split()[0]), "sqlite_stat1"
+    except (sqlite3.DatabaseError, ValueError):
+        pass
 
-def inspect_table(connection: sqlite3.Connection, table: str, include_row_count: bool) -> Dict[str, object]:
-    row_count = fetch_row_count(connection, table) if include_row_count else None
+    try:
+        # WITHOUT ROWID tables have no rowid and raise here.
+        cursor = connection.execute(f"SELECT max(rowid) FROM {quote_identifier(table)}")
+        return cursor.fetchone()[0] or 0, "max_rowid"
+    except sqlite3.DatabaseError:
+        return None, None
+
+
+def inspect_table(
+    connection: Optional[sqlite3.Connection],
+    table: str,
+    sql: Optional[str],
+    details: Dict[str, list],
+    include_row_count: bool,
+    exact_row_count: bool = False,
+) -> Dict[str, object]:
+    row_count, row_count_method = (
+        fetch_row_count(connection, table, exact_row_count) if include_row_count else (None, None)
+    )
     return {
         "name": table,
-        "sql": connection.execute(
-            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
-        ).fetchone()[0],
-        "columns": fetch_table_columns(connection, table),
-        "indexes": fetch_indexes(connection, table),
-        "foreign_keys": fetch_foreign_keys(connection, table),
+        "sql": sql,
+        "columns": details["columns"],
+        "indexes": details["indexes"],
+        "foreign_keys": details["foreign_keys"],
         "row_count": row_count,
+        "row_count_method": row_count_method,
     }
 
 
-def inspect_view(connection: sqlite3.Connection, view: str) -> Dict[str, object]:
-    definition = connection.execute(
-        "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?", (view,)
-    ).fetchone()[0]
-    return {"name": view, "sql": definition}
+def inspect_tables(
+    db_path: Path,
+    tables: List[Tuple[str, Optional[str]]],
+    table_details: Dict[str, Dict[str, list]],
+    include_row_count: bool,
+    exact_row_count: bool = False,
+    max_workers: int = MAX_WORKERS,
+) -> List[Dict[str, object]]:
+    # Without row counts every field comes from table_details, so no connection or pool is needed.
+    if not include_row_count:
+        return [inspect_table(None, name, sql, table_details[name], False) for name, sql in tables]
+
+    local = threading.local()
+    connections: List[sqlite3.Connection] = []
+
+    def worker(table: Tuple[str, Optional[str]]) -> Dict[str, object]:
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = open_readonly(db_path)
+            connections.append(connection)
+        name, sql = table
+        return inspect_table(connection, name, sql, table_details[name], include_row_count, exact_row_count)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tables)))) as executor:
+            return list(executor.map(worker, tables))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def inspect_view(view: str, sql: Optional[str]) -> Dict[str, object]:
+    return {"name": view, "sql": sql}
 
 
 def inspect_schema(connection: sqlite3.Connection) -> Dict[str, object]:
@@ -108,24 +233,23 @@ def inspect_schema(connection: sqlite3.Connection) -> Dict[str, object]:
     return schema_info
 
 
-def inspect_database(db_path: Path, include_row_count: bool) -> Dict[str, object]:
+def inspect_database(
+    db_path: Path, include_row_count: bool, exact_row_count: bool = False, table_workers: int = MAX_WORKERS
+) -> Dict[str, object]:
     file_stats = db_path.stat()
 
-    with sqlite3.connect(db_path) as connection:
-        cursor = connection.cursor()
-        cursor.execute( "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
-        tables = cursor.fetchall()
-        # tables = connection.execute(
-        #     "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
-        # ).fetchall()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'view' ORDER BY name")
-        views = cursor.fetchall()
-        # views = connection.execute(
-        #     "SELECT name FROM sqlite_master WHERE type = 'view' ORDER BY name"
-        # ).fetchall()
-
-        table_details = [inspect_table(connection, row[0], include_row_count) for row in tables]
-        view_details = [inspect_view(connection, row[0]) for row in views]
+    with closing(open_readonly(db_path)) as connection:
+        rows = connection.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY type, name"
+        ).fetchall()
+        tables = [(name, sql) for kind, name, sql in rows if kind == "table"]
+        views = [(name, sql) for kind, name, sql in rows if kind == "view"]
+
+        table_details = inspect_tables(
+            db_path, tables, fetch_table_details(connection), include_row_count, exact_row_count, table_workers
+        )
+        view_details = [inspect_view(name, sql) for name, sql in views]
 
         return {
             "file": str(db_path),
@@ -138,6 +262,25 @@ def inspect_database(db_path: Path, include_row_count: bool) -> Dict[str, object
         }
 
 
+def iter_mtga_files(directory: str, recursive: bool) -> Iterator[str]:
+    """Yield .mtga files under a directory, reading each directory once with os.scandir."""
+    subdirectories = []
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        # Unreadable directories are skipped, as Path.glob does.
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    subdirectories.append(entry.path)
+            elif entry.name.lower().endswith(".mtga") and entry.is_file():
+                yield entry.path
+    for subdirectory in subdirectories:
+        yield from iter_mtga_files(subdirectory, recursive)
+
+
 def discover_databases(targets: Iterable[str], recursive: bool) -> List[Path]:
     discovered: List[Path] = []
     for target in targets:
@@ -145,23 +288,69 @@ def discover_databases(targets: Iterable[str], recursive: bool) -> List[Path]:
         if path.is_file() and path.suffix.lower() == ".mtga":
             discovered.append(path)
         elif path.is_dir():
-            pattern = "**/*.mtga" if recursive else "*.mtga"
-            discovered.extend(sorted(path.glob(pattern)))
+            discovered.extend(Path(file_path) for file_path in iter_mtga_files(str(path), recursive))
         else:
-            discovered.extend(sorted(Path().glob(target)))
+            discovered.extend(match for match in Path().glob(target) if match.suffix.lower() == ".mtga")
 
+    # A file reached through several targets or links has one (device, inode) pair. Filesystems
+    # that report no inode numbers (st_ino == 0, e.g. FAT) fall back to the resolved path.
     unique_paths = []
     seen = set()
     for path in discovered:
-        if path.suffix.lower() != ".mtga":
+        try:
+            key = (stats.st_dev, stats.st_ino) if (stats := path.stat()).st_ino else path.resolve()
+        except OSError:
             continue
-        if path.resolve() in seen:
+        if key in seen:
             continue
-        seen.add(path.resolve())
+        seen.add(key)
         unique_paths.append(path)
     return sorted(unique_paths)
 
 
+def dump_json(data: object, indent: int) -> bytes:
+    # orjson only knows a 2-space indent; other layouts fall back to the stdlib encoder.
+    if indent == 2:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=indent).encode("utf-8")
+
+
+def write_json_array(stream: BinaryIO, items: Iterable[object], indent: int) -> None:
+    """Write items as one JSON array, serializing each item as soon as it is available.
+
+    The layout matches json.dumps(list(items), indent=indent).
+    """
+    newline = b"\n" + b" " * max(indent, 0)
+    first = True
+    for item in items:
+        stream.write(b"[" + newline if first else b"," + newline)
+        # JSON escapes newlines inside strings, so every raw newline is layout and can be re-indented.
+        stream.write(dump_json(item, indent).replace(b"\n", newline))
+        first = False
+    stream.write(b"[]\n" if first else b"\n]\n")
+
+
+def map_in_order(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """Like Executor.map, but with at most `window` results held in memory at once."""
+    pending: deque = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def report_mode(target: Path) -> int:
+    """Mode for a rewritten report: keep an existing file's mode, otherwise follow the umask."""
+    try:
+        return stat.S_IMODE(target.stat().st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description=(
@@ -182,7 +371,15 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--include-row-count",
         action="store_true",
-        help="Include a row count for each table (can be slow on large databases).",
+        help=(
+            "Include a row count for each table, estimated from sqlite_stat1 or max(rowid) "
+            "(an upper bound when rows have been deleted)."
+        ),
+    )
+    parser.add_argument(
+        "--exact-row-count",
+        action="store_true",
+        help="Count table rows exactly with COUNT(*) (can be slow on large databases). Implies --include-row-count.",
     )
     parser.add_argument(
         "-o",
@@ -206,13 +403,34 @@ def main() -> None:
     if not db_paths:
         raise SystemExit("No .mtga database files found for the given targets.")
 
-    summary = [inspect_database(path, args.include_row_count) for path in db_paths]
-    output_text = json.dumps(summary, indent=args.indent)
+    # Files and their tables share one MAX_WORKERS budget, so the nested pools never exceed it.
+    workers = min(MAX_WORKERS, len(db_paths))
+    inspect = partial(
+        inspect_database,
+        include_row_count=args.include_row_count or args.exact_row_count,
+        exact_row_count=args.exact_row_count,
+        table_workers=max(1, MAX_WORKERS // workers),
+    )
 
-    if args.output:
-        args.output.write_text(output_text, encoding="utf-8")
-    else:
-        print(output_text)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        summaries = map_in_order(executor, inspect, db_paths, workers * 2)
+        if args.output:
+            # Stream into a temporary file so a failed inspection never leaves a truncated report behind.
+            # The target is resolved so a symlinked report is rewritten where it points, not replaced.
+            target = args.output.resolve()
+            fd, temp_name = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+            temp_path = Path(temp_name)
+            try:
+                with os.fdopen(fd, "wb") as stream:
+                    write_json_array(stream, summaries, args.indent)
+                os.chmod(temp_path, report_mode(target))
+                os.replace(temp_path, target)
+            except BaseException:
+                temp_path.unlink(missing_ok=True)
+                raise
+        else:
+            write_json_array(sys.stdout.buffer, summaries, args.indent)
+            sys.stdout.buffer.flush()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,102 @@
-import glob
+import functools
 import os
 import io
+import itertools
 import sqlite3
+import pathlib
+import time
 import UnityPy
 import cv2
 import numpy as np
+import texture2ddecoder
+
+# The Raw_*.mtga databases are only ever read, so they are opened read-only and
+# immutable (no locking, no journal) with a large page cache and mmap window.
+SQLITE_PRAGMAS = '''
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+PRAGMA query_only=1;
+'''
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds (999).
+SQLITE_MAX_PARAMS = 900
+
+# Seconds a listing of the AssetBundle directory is reused by find_card_art_file.
+ASSET_LISTING_TTL = 30
+
+# Unity object types that carry card art.
+ART_TYPES = frozenset(("Texture2D", "Sprite"))
+
+# Block-compressed texture formats decoded straight to BGRA, bypassing UnityPy's PIL image.
+BC_DECODERS = {
+        'DXT1': texture2ddecoder.decode_bc1,
+        'DXT5': texture2ddecoder.decode_bc3,
+        'BC7': texture2ddecoder.decode_bc7,
+}
+
+# PIL modes that map straight onto an OpenCV conversion to BGR.
+IMAGE_CONVERSIONS = {
+        'RGBA': cv2.COLOR_RGBA2BGR,
+        'RGB': cv2.COLOR_RGB2BGR,
+        'L': cv2.COLOR_GRAY2BGR,
+}
+
+# Decoded card art, stored as raw BGR bytes so repeated lookups skip UnityPy entirely.
+ART_CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS art (
+        card_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        height INTEGER,
+        width INTEGER,
+        channels INTEGER,
+        data BLOB,
+        PRIMARY KEY (card_id, kind)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+'''
+
+DATABASES = ['ArtCropDatabase', 'CardDatabase', 'ClientLocalization', 'altArtCredits', 'altFlavorTexts', 'credits']
+
+
+@functools.lru_cache(maxsize=None)
+def _prepare_name_query(lang_table, has_limit):
+        return (
+                f'SELECT * FROM Cards WHERE TitleId IN (SELECT LocId FROM {lang_table} WHERE Loc LIKE ?)'
+                + (' LIMIT ?' if has_limit else '')
+        )
+
+
+# How _card_from_row maps each Cards column, classified once per column list.
+COLUMN_PLAIN, COLUMN_TEXT, COLUMN_ABILITY, COLUMN_ART = range(4)
+
+
+@functools.lru_cache(maxsize=None)
+def _classify_columns(names):
+        kinds = []
+        for key in names:
+                if 'TextId' in key or 'TitleId' in key:
+                        kinds.append((COLUMN_TEXT, key.replace("Id", "").lower()))
+                elif 'AbilityIds' in key:
+                        kinds.append((COLUMN_ABILITY, key.replace("Id", "").lower()))
+                elif 'ArtId' in key:
+                        kinds.append((COLUMN_ART, 'art'))
+                else:
+                        kinds.append((COLUMN_PLAIN, key))
+        return tuple(kinds)
+
+
+class _ConnectionDict(dict):
+        """Opens each database connection the first time it is looked up."""
+
+        def __init__(self, paths, opener):
+                super().__init__()
+                self.paths = paths
+                self.opener = opener
+
+        def __missing__(self, db):
+                connection = self[db] = self.opener(self.paths[db])
+                return connection
 
 
 class mtga_reader:
@@ -12,49 +104,68 @@ class mtga_reader:
         mtga_data_dir = None
         mtga_assets_dir = None
         mtga_raw_dir = None
+        art_cache_path = None
+        database_paths = {}
         lang = None
         lang_table = None
         default_lang_table = None
         connections = {}
-        enums = {}
 
-        def __init__(self, mtga_root_dir, lang='en'):
+        def __init__(self, mtga_root_dir, lang='en', art_cache_path=None):
                 self.lang = lang
                 self.mtga_root_dir = mtga_root_dir
                 self.mtga_data_dir = os.path.join(self.mtga_root_dir, "MTGA_Data")
                 self.mtga_assets_dir = os.path.join(self.mtga_data_dir, "Downloads", "AssetBundle")
                 self.mtga_raw_dir = os.path.join(self.mtga_data_dir, "Downloads", "Raw")
+                self.art_cache_path = art_cache_path or os.path.join(self.mtga_data_dir, "art_cache.sqlite")
+                self._art_cache = None
+                self._art_cache_mtime = None
+                self._localization_cache = {}
+                self._ability_cache = {}
+                self._asset_listing = None
+                self._asset_listing_time = 0
                 self.get_databases()
                 self.set_language(lang)
-                self.get_enums()
 
-        def dict_factory(self, cursor, row):
-                d = {}
-                for idx, col in enumerate(cursor.description):
-                    d[col[0]] = row[idx]
-                return d
+        def _row_to_dict(self, description, row):
+                return {col[0]: val for col, val in zip(description, row)}
 
         def get_databases(self):
                 try:
-                        dbs = ['ArtCropDatabase', 'CardDatabase', 'ClientLocalization', 'altArtCredits', 'altFlavorTexts', 'credits']
-                        for db in dbs:
-                                self.connections[db] = sqlite3.connect(
-                                        max(
-                                                glob.glob(os.path.join(self.mtga_raw_dir, f"Raw_{db}_*.mtga")),
-                                                key=os.path.getctime
-                                        )
-                                )
-                                self.connections[db].row_factory = self.dict_factory
+                        prefixes = {f"Raw_{db}_": db for db in DATABASES}
+                        newest = {}
+                        with os.scandir(self.mtga_raw_dir) as entries:
+                                for entry in entries:
+                                        if not entry.name.endswith(".mtga"):
+                                                continue
+                                        for prefix, db in prefixes.items():
+                                                if entry.name.startswith(prefix):
+                                                        ctime = entry.stat().st_ctime
+                                                        if db not in newest or ctime > newest[db][0]:
+                                                                newest[db] = (ctime, entry.path)
+                                                        break
+
+                        self.database_paths = {db: newest[db][1] for db in DATABASES}
+                        self.connections = _ConnectionDict(self.database_paths, self.open_database)
                         return True
                 except Exception:
-                        self.connections = {}
+                        self.database_paths = {}
+                        self.connections = _ConnectionDict(self.database_paths, self.open_database)
                         return False
 
+        def open_database(self, path):
+                uri = pathlib.Path(os.path.abspath(path)).as_uri() + '?mode=ro&immutable=1'
+                connection = sqlite3.connect(
+                        uri, isolation_level=None, check_same_thread=False, uri=True, cached_statements=256
+                )
+                connection.executescript(SQLITE_PRAGMAS)
+                return connection
+
         def set_language(self, lang):
                 """Validate and store the localization table for the chosen language."""
                 cursor = self.connections['CardDatabase'].cursor()
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'Localizations_%'")
-                available_tables = [row['name'] for row in cursor.fetchall()]
+                available_tables = [row[0] for row in cursor.fetchall()]
 
                 def normalize(name):
                         return name.replace('-', '').replace('_', '').lower()
@@ -76,34 +187,117 @@ class mtga_reader:
 
                 self.lang = lang
                 self.lang_table = matched_table
+                self.available_lang_tables = set(available_tables)
+                self._loc_sql = {
+                        table: f'SELECT Loc FROM {table} WHERE LocId = ? ORDER BY Formatted DESC LIMIT 1'
+                        for table in (self.lang_table, self.default_lang_table)
+                }
+                self._loc_cursor = cursor
+                self._localization_cache.clear()
+                self._ability_cache.clear()
+                # Translated enums are rebuilt for the new language on next access.
+                self.__dict__.pop('enums', None)
                 return matched_table
 
         def close(self):
                 for db in self.connections:
                         self.connections[db].close()
+                if self._art_cache:
+                        self._art_cache.close()
+                        self._art_cache = None
                 return True
 
+        @functools.cached_property
+        def enums(self):
+                return self._load_enums()
+
         def get_enums(self):
+                self.enums = self._load_enums()
+                return True
+
+        def _load_enums(self):
                 cursor = self.connections['CardDatabase'].cursor()
-                cursor.execute('Select "Type" FROM Enums GROUP BY "Type"')
+                cursor.execute('SELECT "Type", Value, LocId FROM Enums ORDER BY "Type"')
 
-                for linha in cursor.fetchall():
-                        self.enums[linha['Type']] = {}
+                rows = cursor.fetchall()
+                translations = self.get_card_translations(row[2] for row in rows)
 
-                for enum_type in self.enums:
-                        cursor.execute('Select Value, LocId  FROM Enums WHERE "Type" = ?', (enum_type,))
-                        for linha in cursor.fetchall():
-                                self.enums[enum_type][linha['Value']] = self.get_card_translation_id(linha['LocId'])
+                enums = {}
+                for enum_type, group in itertools.groupby(rows, key=lambda row: row[0]):
+                        enums[enum_type] = {value: translations.get(loc_id) for _, value, loc_id in group}
+                return enums
 
+        def preload_localizations(self, table_name=None):
+                """Load a whole localization table into the lookup cache with a single query."""
+                table_name = table_name or self.lang_table
+                cursor = self.connections['CardDatabase'].cursor()
+                # Ascending Formatted order lets the highest one win, as in _lookup_localization.
+                cursor.execute(f'SELECT LocId, Loc FROM {table_name} ORDER BY Formatted')
+                for text_id, loc in cursor.fetchall():
+                        self._localization_cache[(table_name, text_id)] = loc
                 return True
 
         def _lookup_localization(self, text_id, table_name):
-                cursor = self.connections['CardDatabase'].cursor()
-                cursor.execute(
-                        f'SELECT Loc FROM {table_name} WHERE LocId = ? ORDER BY Formatted DESC LIMIT 1', (text_id,)
+                key = (table_name, text_id)
+                if key not in self._localization_cache:
+                        self._localization_cache[key] = self._query_localization(text_id, table_name)
+                return self._localization_cache[key]
+
+        def _query_localization(self, text_id, table_name):
+                sql = self._loc_sql.get(table_name) or (
+                        f'SELECT Loc FROM {table_name} WHERE LocId = ? ORDER BY Formatted DESC LIMIT 1'
                 )
-                row = cursor.fetchone()
-                return row['Loc'] if row else None
+                row = self._loc_cursor.execute(sql, (text_id,)).fetchone()
+                return row[0] if row else None
+
+        def _lookup_localizations(self, text_ids, table_name):
+                ret = {}
+                missing = []
+                for text_id in text_ids:
+                        key = (table_name, text_id)
+                        if key in self._localization_cache:
+                                ret[text_id] = self._localization_cache[key]
+                        else:
+                                missing.append(text_id)
+
+                cursor = self.connections['CardDatabase'].cursor()
+                for start in range(0, len(missing), SQLITE_MAX_PARAMS):
+                        chunk = missing[start:start + SQLITE_MAX_PARAMS]
+                        for text_id in chunk:
+                                ret[text_id] = None
+                        cursor.execute(
+                                f'SELECT LocId, Loc FROM {table_name} WHERE LocId IN ({",".join("?" * len(chunk))}) ORDER BY Formatted',
+                                chunk
+                        )
+                        # Ascending Formatted order lets the highest one win, as in _query_localization.
+                        for text_id, loc in cursor.fetchall():
+                                ret[text_id] = loc
+
+                for text_id in missing:
+                        self._localization_cache[(table_name, text_id)] = ret[text_id]
+                return ret
+
+        def get_card_translations(self, text_ids):
+                """Batch version of get_card_translation_id, returning a {text_id: translation} dict."""
+                text_ids = {text_id for text_id in text_ids if text_id is not None}
+                ret = {text_id: text_id for text_id in text_ids}
+
+                try:
+                        pending = text_ids
+                        for table_name in (self.lang_table, self.default_lang_table):
+                                if not pending or not table_name:
+                                        break
+                                translations = self._lookup_localizations(pending, table_name)
+                                pending = set()
+                                for text_id, translation in translations.items():
+                                        if translation:
+                                                ret[text_id] = translation
+                                        else:
+                                                pending.add(text_id)
+                except Exception:
+                        pass
+
+                return ret
 
         def get_card_translation_id(self, text_id):
                 if text_id is None:
@@ -124,51 +318,92 @@ class mtga_reader:
                 return text_id
 
         def get_card_abilities(self, ability_id):
-                try:
-                        cursor = self.connections['CardDatabase'].cursor()
-                        cursor.execute('select * from Abilities WHERE Id = ?', (ability_id,))
-                        ret = []
-                        for linha in cursor.fetchall():
-                                linha['TextId'] = self.get_card_translation_id(linha['TextId'])
-                                ret.append(linha)
-                        return ret[0] if ret else None
-                except Exception:
-                        return ability_id
+                if ability_id not in self._ability_cache:
+                        try:
+                                cursor = self.connections['CardDatabase'].cursor()
+                                cursor.execute('select * from Abilities WHERE Id = ?', (ability_id,))
+                                row = cursor.fetchone()
+                                ret = None
+                                if row is not None:
+                                        ret = self._row_to_dict(cursor.description, row)
+                                        ret['TextId'] = self.get_card_translation_id(ret['TextId'])
+                                self._ability_cache[ability_id] = ret
+                        except Exception:
+                                return ability_id
+
+                # Every caller gets its own dict so mutating one card never touches the cache.
+                ret = self._ability_cache[ability_id]
+                return dict(ret) if ret is not None else None
 
         def get_card_by_id(self, card_id, get_art=True):
                 cursor = self.connections['CardDatabase'].cursor()
                 cursor.execute('SELECT * FROM Cards WHERE GrpId = ? LIMIT 1', (card_id,))
-                ret = []
-                for linha in cursor.fetchall():
-                        tmp = {}
-                        for key, val in linha.items():
-                                if 'TextId' in key or 'TitleId' in key:
-                                        tmp[key.replace("Id", "").lower()] = val if val is None else self.get_card_translation_id(val)
-                                elif 'AbilityIds' in key:
-                                        tmp[key.replace("Id", "").lower()] = val if val is None else self.get_card_abilities(val)
-                                elif 'ArtId' in key:
-                                        tmp['art'] = val if (val is None or not get_art) else self.get_card_art_by_id(val)
-                                else:
-                                        tmp[key] = val
-                        ret.append(tmp)
-                return ret[0] if ret else None
+                names = tuple(col[0] for col in cursor.description)
+                row = cursor.fetchone()
+                return self._card_from_row(names, row, get_art) if row else None
 
         def get_card_by_name(self, card_name, limit=None, get_art=True):
+                if self.lang_table not in self.available_lang_tables:
+                        raise ValueError(f"Unknown localization table '{self.lang_table}'.")
+
                 cursor = self.connections['CardDatabase'].cursor()
 
-                query = (
-                        f'SELECT GrpId FROM Cards WHERE TitleId IN (select LocId from {self.lang_table} WHERE Loc like ?)'
-                        + (f' LIMIT ?' if limit else '')
-                )
                 params = [card_name]
                 if limit:
                         params.append(limit)
 
-                cursor.execute(query, params)
-                ret = []
-                for linha in cursor.fetchall():
-                        ret.append(self.get_card_by_id(linha['GrpId'], get_art))
-                return ret
+                cursor.execute(_prepare_name_query(self.lang_table, bool(limit)), params)
+                names = tuple(col[0] for col in cursor.description)
+                return [self._card_from_row(names, linha, get_art) for linha in cursor.fetchall()]
+
+        def _card_from_row(self, names, row, get_art):
+                tmp = {}
+                for (kind, key), val in zip(_classify_columns(names), row):
+                        if kind == COLUMN_PLAIN or val is None:
+                                tmp[key] = val
+                        elif kind == COLUMN_TEXT:
+                                tmp[key] = self.get_card_translation_id(val)
+                        elif kind == COLUMN_ABILITY:
+                                tmp[key] = self.get_card_abilities(val)
+                        else:
+                                tmp[key] = self.get_card_art_by_id(val) if get_art else val
+                return tmp
+
+        def _list_asset_files(self):
+                now = time.monotonic()
+                if self._asset_listing is None or now - self._asset_listing_time > ASSET_LISTING_TTL:
+                        try:
+                                with os.scandir(self.mtga_assets_dir) as entries:
+                                        self._asset_listing = sorted(
+                                                (entry.name, entry.path) for entry in entries if entry.name.endswith(".mtga")
+                                        )
+                        except OSError:
+                                # A missing or unreadable AssetBundle directory simply has no art.
+                                self._asset_listing = []
+                        self._asset_listing_time = now
+                return self._asset_listing
+
+        def _decode_art(self, data):
+                # Sprites have no texture format of their own and always go through data.image.
+                texture_format = getattr(data, 'm_TextureFormat', None)
+                decoder = BC_DECODERS.get(getattr(texture_format, 'name', None))
+                if decoder is None:
+                        return self._image_to_bgr(data.image)
+
+                width, height = data.m_Width, data.m_Height
+                bgra = np.frombuffer(decoder(data.image_data, width, height), dtype=np.uint8).reshape(height, width, 4)
+                # Unity stores textures bottom-up.
+                return cv2.flip(cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR), 0)
+
+        def _image_to_bgr(self, image):
+                conversion = IMAGE_CONVERSIONS.get(image.mode)
+                if conversion is not None:
+                        return cv2.cvtColor(np.asarray(image), conversion)
+
+                # Any other mode goes through a PNG round-trip, which cv2 decodes to BGR.
+                img_byte_arr = io.BytesIO()
+                image.save(img_byte_arr, format='PNG')
+                return cv2.imdecode(np.frombuffer(img_byte_arr.getbuffer(), dtype=np.uint8), cv2.IMREAD_COLOR)
 
         def find_card_art_file(self, card_id):
                 ret = {
@@ -176,27 +411,91 @@ class mtga_reader:
                     'util': None
                 }
 
-                for file_name in glob.glob(f"{self.mtga_assets_dir}{str(card_id).zfill(6)}*.mtga"):
+                prefix = str(card_id).zfill(6)
+                aif_marker = f'{card_id}_AIF.'
+                for name, file_name in self._list_asset_files():
+                    if not name.startswith(prefix):
+                        continue
                     env = UnityPy.load(file_name)
 
                     for path, obj in env.container.items():
-                        if obj.type.name in ["Texture2D", "Sprite"]:
-                            data = obj.read()
-                            img_byte_arr = io.BytesIO()
-                            data.image.save(img_byte_arr, format='PNG')
-
-                            image = np.asarray(bytearray(img_byte_arr.getvalue()), dtype="uint8")
-                            image = cv2.imdecode(image, cv2.IMREAD_COLOR)
-
-                            if 'Util' in path:
-                                ret['util'] = image
-                            if f'{card_id}_AIF.' in path:
-                                ret['image'] = image
-                            else:
-                                tmp = path.split(".")[0].split("_")[-1]
-                                ret[tmp] = image
+                        if obj.type.name not in ART_TYPES:
+                            continue
+                        data = obj.read()
+                        image = self._decode_art(data)
+
+                        if 'Util' in path:
+                            kind = 'util'
+                        elif aif_marker in path:
+                            kind = 'image'
+                        else:
+                            kind = path.partition(".")[0].rpartition("_")[2]
+                        ret[kind] = image
                 return ret
 
+        def _get_art_cache(self):
+                try:
+                        if self._art_cache is None:
+                                self._art_cache = sqlite3.connect(self.art_cache_path, check_same_thread=False)
+                                self._art_cache.executescript(ART_CACHE_SCHEMA)
+                                row = self._art_cache.execute("SELECT value FROM meta WHERE key = 'assets_mtime'").fetchone()
+                                self._art_cache_mtime = row[0] if row else None
+
+                        # Game updates touch the AssetBundle directory, which invalidates everything cached.
+                        assets_mtime = os.stat(self.mtga_assets_dir).st_mtime
+                        if assets_mtime != self._art_cache_mtime:
+                                with self._art_cache:
+                                        self._art_cache.execute('DELETE FROM art')
+                                        self._art_cache.execute(
+                                                "INSERT OR REPLACE INTO meta (key, value) VALUES ('assets_mtime', ?)", (assets_mtime,)
+                                        )
+                                self._art_cache_mtime = assets_mtime
+                        return self._art_cache
+                except (OSError, sqlite3.Error):
+                        return None
+
+        def _load_cached_art(self, cache, card_id):
+                rows = cache.execute(
+                        'SELECT kind, height, width, channels, data FROM art WHERE card_id = ? ORDER BY rowid', (card_id,)
+                ).fetchall()
+                if not rows:
+                        return None
+
+                ret = {}
+                for kind, height, width, channels, data in rows:
+                        if data is None:
+                                ret[kind] = None
+                        else:
+                                shape = (height, width) if channels is None else (height, width, channels)
+                                ret[kind] = np.frombuffer(bytearray(data), dtype=np.uint8).reshape(shape)
+                return ret
+
+        def _store_cached_art(self, cache, card_id, art):
+                rows = []
+                for kind, image in art.items():
+                        if image is None:
+                                rows.append((card_id, kind, None, None, None, None))
+                        else:
+                                channels = image.shape[2] if image.ndim == 3 else None
+                                rows.append((card_id, kind, image.shape[0], image.shape[1], channels, image.tobytes()))
+                with cache:
+                        cache.executemany('INSERT OR REPLACE INTO art VALUES (?, ?, ?, ?, ?, ?)', rows)
+
         def get_card_art_by_id(self, card_id):
+                cache = self._get_art_cache()
+                if cache is not None:
+                        try:
+                                cached = self._load_cached_art(cache, card_id)
+                                if cached is not None:
+                                        return cached
+                        except sqlite3.Error:
+                                cache = None
+
                 tmp = self.find_card_art_file(card_id)
+
+                if cache is not None:
+                        try:
+                                self._store_cached_art(cache, card_id, tmp)
+                        except sqlite3.Error:
+                                pass
                 return tmp